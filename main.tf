@@ -544,6 +544,17 @@ resource "google_dataproc_cluster" "etl_cluster" {
       ]
 
       tags = ["dataproc-cluster", var.environment, "ssh-access"]
+
+      # Python packages installed by the pip-install initialization action
+      metadata = {
+        PIP_PACKAGES = var.dataproc_pip_packages
+      }
+    }
+
+    # Installs PIP_PACKAGES (psycopg2 for driver-side PostgreSQL access) on every node
+    initialization_action {
+      script      = "gs://goog-dataproc-initialization-actions-${var.data_region}/python/pip-install.sh"
+      timeout_sec = 600
     }
   }
 
@@ -3,22 +3,212 @@
 Database Utilities for PostgreSQL with Secret Manager Integration
 
 This module provides utilities for:
-- Secure password retrieval from Google Secret Manager
+- Secure password retrieval from Google Secret Manager (cached with a TTL)
 - JDBC connection properties for Spark
+- Pooled driver-side PostgreSQL connections (psycopg2)
+- Index and statistics management for Spark-loaded tables
 - Database connection details
 """
 
 import os
+import json
+import stat
 import time
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import secrets
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    import psycopg2
+    from psycopg2 import pool as psycopg2_pool
+except ImportError:  # installed on the cluster via PIP_PACKAGES (see main.tf)
+    psycopg2 = None
+    psycopg2_pool = None
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Default lifetime of a cached secret, overridable with SECRET_CACHE_TTL
+# (0 disables expiry in-process and the cross-process file cache)
+DEFAULT_SECRET_TTL = 300
+
+# Keys and indexes applied after Spark (re)creates a reference table
+REFERENCE_TABLE_SCHEMA = {
+    "products": {
+        "primary_key": ["product_id"],
+        "indexes": [["category"], ["supplier_id"]],
+    },
+    "stores": {
+        "primary_key": ["store_id"],
+        "indexes": [["store_location"], ["region"]],
+    },
+}
+
+# Process-wide secret cache: (project_id, secret_id) -> (value, expires_at)
+_secret_cache: Dict[tuple, tuple] = {}
+_secret_cache_lock = threading.Lock()
+
+
+def _secret_cache_dir() -> Optional[str]:
+    """
+    Return the private per-user directory for the secret file cache
+    
+    Uses SECRET_CACHE_DIR, then $XDG_RUNTIME_DIR/etl-secrets, then
+    ~/.cache/etl-secrets. The directory is created with mode 0700 and rejected
+    unless it is a real directory owned by the current user with no group or
+    other permissions.
+    
+    Returns:
+        str: Cache directory, or None if no safe directory is available
+    """
+    cache_dir = os.getenv('SECRET_CACHE_DIR')
+    if not cache_dir:
+        runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+        base_dir = runtime_dir or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(base_dir, 'etl-secrets')
+    
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.lstat(cache_dir)
+    except OSError as e:
+        logger.warning(f"Secret cache directory unavailable: {str(e)}")
+        return None
+    
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        logger.warning(f"Ignoring insecure secret cache directory {cache_dir}")
+        return None
+    return cache_dir
+
+
+def _secret_cache_path(cache_dir: str, project_id: str, secret_id: str) -> str:
+    """Return the cache file for a secret inside the private cache directory"""
+    digest = hashlib.sha256(f"{project_id}/{secret_id}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"secret-{digest}.json")
+
+
+def _read_secret_file(path: str) -> Optional[dict]:
+    """
+    Read a secret cache file, rejecting symlinks and files that are not private
+    
+    Returns:
+        dict: Parsed cache entry, or None if missing, insecure or unreadable
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    
+    with os.fdopen(fd) as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            logger.warning(f"Ignoring insecure secret cache file {path}")
+            return None
+        try:
+            entry = json.load(f)
+        except ValueError:
+            return None
+    
+    return entry if isinstance(entry, dict) else None
+
+
+def get_cached_secret(project_id: str, secret_id: str) -> Optional[Tuple[str, float]]:
+    """
+    Look up a secret in the in-process cache, then the per-user file cache
+    
+    Returns:
+        tuple: (secret value, expiry timestamp), or None if missing or expired
+    """
+    key = (project_id, secret_id)
+    now = time.time()
+    with _secret_cache_lock:
+        cached = _secret_cache.get(key)
+        if cached and cached[1] > now:
+            return cached
+    
+    cache_dir = _secret_cache_dir()
+    if cache_dir is None:
+        return None
+    
+    entry = _read_secret_file(_secret_cache_path(cache_dir, project_id, secret_id))
+    if not entry or not entry.get("value"):
+        return None
+    
+    expires_at = entry.get("expires_at")
+    if not isinstance(expires_at, (int, float)) or expires_at <= now:
+        return None
+    
+    with _secret_cache_lock:
+        _secret_cache[key] = (entry["value"], float(expires_at))
+    return entry["value"], float(expires_at)
+
+
+def cache_secret(project_id: str, secret_id: str, value: str, ttl: int) -> None:
+    """
+    Store a secret in the in-process and per-user file caches
+    
+    The file is written to a uniquely named temporary file created with
+    O_EXCL|O_NOFOLLOW and mode 0600, then renamed into place.
+    """
+    if ttl <= 0:
+        return
+    
+    expires_at = time.time() + ttl
+    with _secret_cache_lock:
+        _secret_cache[(project_id, secret_id)] = (value, expires_at)
+    
+    cache_dir = _secret_cache_dir()
+    if cache_dir is None:
+        return
+    
+    path = _secret_cache_path(cache_dir, project_id, secret_id)
+    tmp_path = os.path.join(cache_dir, f".secret-{secrets.token_hex(8)}.tmp")
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"value": value, "expires_at": expires_at}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write secret cache file: {str(e)}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def invalidate_cached_secret(project_id: str, secret_id: str) -> None:
+    """Drop a secret from the in-process cache and delete its cache file"""
+    with _secret_cache_lock:
+        _secret_cache.pop((project_id, secret_id), None)
+    
+    cache_dir = _secret_cache_dir()
+    if cache_dir is None:
+        return
+    try:
+        os.unlink(_secret_cache_path(cache_dir, project_id, secret_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove secret cache file: {str(e)}")
+
+
+def clear_secret_cache() -> None:
+    """Drop all secrets held in the in-process cache"""
+    with _secret_cache_lock:
+        _secret_cache.clear()
+
+
+def _is_auth_failure(error: Exception) -> bool:
+    """Return True if a connection error was caused by rejected credentials"""
+    return (getattr(error, 'pgcode', None) == '28P01'
+            or 'authentication failed' in str(error))
+
+
 class DatabaseManager:
     """
-    Database manager for Spark JDBC connections
+    Database manager for Spark JDBC connections and pooled driver-side access
     """
     
     def __init__(self, 
@@ -27,7 +217,11 @@ class DatabaseManager:
                  host: str,
                  database: str,
                  username: str,
-                 port: int = 5432):
+                 port: int = 5432,
+                 pool_min_size: int = 1,
+                 pool_max_size: int = 4,
+                 secret_ttl: Optional[int] = None,
+                 connect_timeout: int = 10):
         """
         Initialize database manager
         
@@ -38,6 +232,11 @@ class DatabaseManager:
             database: Database name
             username: Database username
             port: Database port
+            pool_min_size: Minimum connections kept open by the driver-side pool
+            pool_max_size: Maximum connections opened by the driver-side pool
+            secret_ttl: Seconds a retrieved password stays cached
+                (defaults to SECRET_CACHE_TTL or DEFAULT_SECRET_TTL)
+            connect_timeout: Timeout in seconds for driver-side connections
         """
         self.project_id = project_id
         self.secret_id = secret_id
@@ -45,12 +244,30 @@ class DatabaseManager:
         self.database = database
         self.username = username
         self.port = port
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        if secret_ttl is None:
+            secret_ttl = int(os.getenv('SECRET_CACHE_TTL', DEFAULT_SECRET_TTL))
+        self.secret_ttl = secret_ttl
+        self.connect_timeout = connect_timeout
         self._password = None
+        self._password_expires_at = 0.0
+        self._pool = None
+        self._pool_lock = threading.Lock()
+    
+    def _secret_expiry(self) -> float:
+        """Return when a freshly retrieved password should be fetched again"""
+        if self.secret_ttl <= 0:
+            return float('inf')
+        return time.time() + self.secret_ttl
     
     def get_password(self, max_retries: int = 3, retry_delay: int = 1) -> str:
         """
         Get database password from environment variable with fallback
         
+        Passwords fetched through gcloud are cached for ``secret_ttl`` seconds,
+        both in-process and in a per-user file so later processes skip gcloud.
+        
         Args:
             max_retries: Maximum number of retry attempts (unused in env var mode)
             retry_delay: Delay between retries in seconds (unused in env var mode)
@@ -61,16 +278,24 @@ class DatabaseManager:
         Raises:
             Exception: If password cannot be retrieved
         """
-        if self._password is not None:
+        if self._password is not None and self._password_expires_at > time.time():
             return self._password
         
         # Try environment variable first
         env_password = os.getenv('DATABASE_PASSWORD')
         if env_password:
             self._password = env_password
+            self._password_expires_at = float('inf')
             logger.info("Using database password from environment variable")
             return self._password
         
+        # Then a previously fetched secret that has not expired yet
+        cached = get_cached_secret(self.project_id, self.secret_id)
+        if cached:
+            self._password, self._password_expires_at = cached
+            logger.info("Using cached database password")
+            return self._password
+        
         # Fallback: try to get from secret manager using gcloud command
         try:
             import subprocess
@@ -82,6 +307,8 @@ class DatabaseManager:
             
             if result.returncode == 0:
                 self._password = result.stdout.strip()
+                self._password_expires_at = self._secret_expiry()
+                cache_secret(self.project_id, self.secret_id, self._password, self.secret_ttl)
                 logger.info("Successfully retrieved database password using gcloud")
                 return self._password
             else:
@@ -92,6 +319,12 @@ class DatabaseManager:
         
         raise Exception(f"Could not retrieve password for secret {self.secret_id}")
     
+    def invalidate_password(self) -> None:
+        """Forget the current password so the next lookup fetches it again"""
+        self._password = None
+        self._password_expires_at = 0.0
+        invalidate_cached_secret(self.project_id, self.secret_id)
+    
     def get_spark_jdbc_properties(self) -> Dict[str, Any]:
         """
         Get JDBC properties for Spark connections
@@ -122,12 +355,195 @@ class DatabaseManager:
         """
         return f"jdbc:postgresql://{self.host}:{self.port}/{self.database}"
     
+    def _get_pool(self):
+        """
+        Get or lazily create the driver-side connection pool
+        
+        Returns:
+            ThreadedConnectionPool: psycopg2 connection pool
+            
+        If authentication fails, the cached password is invalidated and the
+        pool is opened once more with a freshly retrieved password, so a
+        rotated secret is picked up without waiting for the cache TTL.
+        
+        Raises:
+            RuntimeError: If psycopg2 is not installed
+        """
+        if psycopg2_pool is None:
+            raise RuntimeError(
+                "psycopg2 is required for driver-side database access; "
+                "install it on the cluster (PIP_PACKAGES in main.tf)"
+            )
+        
+        with self._pool_lock:
+            if self._pool is None:
+                logger.info(f"Opening connection pool to {self.host}:{self.port}/{self.database}")
+                try:
+                    self._pool = self._open_pool()
+                except psycopg2.OperationalError as e:
+                    if not _is_auth_failure(e):
+                        raise
+                    logger.warning("Database authentication failed, refreshing cached password")
+                    self.invalidate_password()
+                    self._pool = self._open_pool()
+            return self._pool
+    
+    def _open_pool(self):
+        """Open a new connection pool with the current password"""
+        return psycopg2_pool.ThreadedConnectionPool(
+            self.pool_min_size,
+            self.pool_max_size,
+            host=self.host,
+            port=self.port,
+            dbname=self.database,
+            user=self.username,
+            password=self.get_password(),
+            connect_timeout=self.connect_timeout,
+            application_name="sales-analytics-etl"
+        )
+    
+    @contextmanager
+    def get_connection(self) -> Iterator[Any]:
+        """
+        Borrow a pooled connection, committing on success and rolling back on error
+        
+        Yields:
+            connection: psycopg2 connection returned to the pool afterwards
+        """
+        conn_pool = self._get_pool()
+        conn = conn_pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            conn_pool.putconn(conn, close=broken or bool(conn.closed))
+    
+    def execute(self, sql: str, params: Optional[tuple] = None) -> List[tuple]:
+        """
+        Execute a statement on a pooled connection
+        
+        Args:
+            sql: SQL statement
+            params: Optional query parameters
+            
+        Returns:
+            list: Fetched rows, empty for statements without a result set
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall() if cursor.description else []
+    
+    def close(self) -> None:
+        """Close all pooled connections"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                logger.info("Closed database connection pool")
+    
+    @staticmethod
+    def _quote_columns(columns: List[str]) -> str:
+        """Return a comma-separated list of double-quoted column identifiers"""
+        return ", ".join(f'"{column}"' for column in columns)
+    
+    def ensure_table_indexes(self, table: str, primary_key: Optional[List[str]] = None,
+                             indexes: Optional[List[List[str]]] = None) -> bool:
+        """
+        Create the primary key and indexes for a table, then refresh statistics
+        
+        Spark's JDBC writer recreates tables in overwrite mode without keys, so
+        this should run after every load. All statements are idempotent.
+        
+        Duplicate or NULL key values are treated as a data-quality problem, not
+        a load failure: the primary key is skipped with a warning and the
+        secondary indexes and ANALYZE still run.
+        
+        Args:
+            table: Table name
+            primary_key: Primary key columns, added if the table has none
+            indexes: Column lists to create secondary indexes on
+            
+        Returns:
+            bool: True if the table has the primary key afterwards
+        """
+        has_primary_key = not primary_key
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                if primary_key:
+                    cursor.execute(
+                        "SELECT 1 FROM pg_constraint "
+                        "WHERE conrelid = to_regclass(%s) AND contype = 'p'",
+                        (table,)
+                    )
+                    has_primary_key = cursor.fetchone() is not None
+                    if not has_primary_key:
+                        logger.info(f"Adding primary key ({', '.join(primary_key)}) on {table}")
+                        cursor.execute("SAVEPOINT add_primary_key")
+                        try:
+                            cursor.execute(
+                                f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" '
+                                f'PRIMARY KEY ({self._quote_columns(primary_key)})'
+                            )
+                            has_primary_key = True
+                        except psycopg2.IntegrityError as e:
+                            cursor.execute("ROLLBACK TO SAVEPOINT add_primary_key")
+                            logger.warning(
+                                f"Data quality: {table} has duplicate or NULL "
+                                f"{', '.join(primary_key)} values, primary key not added: "
+                                f"{str(e).strip()}"
+                            )
+                        cursor.execute("RELEASE SAVEPOINT add_primary_key")
+                
+                for columns in indexes or []:
+                    index_name = f"{table}_{'_'.join(columns)}_idx"
+                    logger.info(f"Ensuring index {index_name}")
+                    cursor.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}" '
+                        f'({self._quote_columns(columns)})'
+                    )
+                
+                logger.info(f"Analyzing {table}")
+                cursor.execute(f'ANALYZE "{table}"')
+        
+        return has_primary_key
+    
+    def optimize_reference_tables(self, tables: Optional[List[str]] = None) -> Dict[str, bool]:
+        """
+        Apply REFERENCE_TABLE_SCHEMA keys, indexes and statistics
+        
+        Args:
+            tables: Subset of reference tables to optimize (defaults to all)
+            
+        Returns:
+            dict: Table name -> whether its primary key is in place
+        """
+        results = {}
+        for table in tables or list(REFERENCE_TABLE_SCHEMA):
+            schema = REFERENCE_TABLE_SCHEMA[table]
+            results[table] = self.ensure_table_indexes(
+                table,
+                primary_key=schema.get("primary_key"),
+                indexes=schema.get("indexes")
+            )
+        return results
+    
     def health_check(self) -> bool:
         """
-        Perform basic validation of connection parameters
+        Validate connection parameters and verify the database is reachable
+        
+        Runs ``SELECT 1`` through the connection pool, so this fails if
+        psycopg2 is missing, credentials are wrong or the server is unreachable.
         
         Returns:
-            bool: True if parameters are valid, False otherwise
+            bool: True if the database is reachable, False otherwise
         """
         try:
             # Validate required parameters
@@ -141,11 +557,13 @@ class DatabaseManager:
                 logger.error("Failed to retrieve database password")
                 return False
             
-            logger.info("Database parameters validation: PASSED")
+            self.execute("SELECT 1")
+            
+            logger.info("Database connectivity check: PASSED")
             return True
             
         except Exception as e:
-            logger.error(f"Database parameters validation failed: {str(e)}")
+            logger.error(f"Database connectivity check failed: {str(e)}")
             return False
 
 
@@ -176,27 +594,38 @@ def create_database_manager_from_env() -> DatabaseManager:
         secret_id=required_vars['SQL_PASSWORD_SECRET'],
         host=required_vars['CLOUDSQL_IP'],
         database=required_vars['DATABASE_NAME'],
-        username=required_vars['DATABASE_USER']
+        username=required_vars['DATABASE_USER'],
+        port=int(os.getenv('DATABASE_PORT', 5432))
     )
 
 
 # Example usage functions
 def test_database_connection():
-    """Test database connection parameters using environment variables"""
+    """
+    Test database connectivity using environment variables
+    
+    Point CLOUDSQL_IP/DATABASE_PORT at a local PostgreSQL and set
+    DATABASE_PASSWORD to run this without Cloud SQL or Secret Manager.
+    """
+    db_manager = None
     try:
         db_manager = create_database_manager_from_env()
         
-        # Test parameter validation
+        # Test connectivity
         if db_manager.health_check():
-            logger.info("Database connection parameters test PASSED")
+            logger.info("Database connection test PASSED")
             return True
         else:
-            logger.error("Database connection parameters test FAILED")
+            logger.error("Database connection test FAILED")
             return False
             
     except Exception as e:
         logger.error(f"Database connection test failed: {str(e)}")
         return False
+    
+    finally:
+        if db_manager is not None:
+            db_manager.close()
 
 
 if __name__ == "__main__":
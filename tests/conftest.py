@@ -0,0 +1,6 @@
+"""Shared pytest configuration: make the PySpark job modules importable"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "pyspark-jobs"))
@@ -0,0 +1,290 @@
+"""
+Tests for database_utils
+
+The secret cache tests use a temporary directory. The PostgreSQL tests run
+against a local or docker PostgreSQL and are skipped unless TEST_DATABASE_HOST
+is set (optionally with TEST_DATABASE_PORT, TEST_DATABASE_NAME,
+TEST_DATABASE_USER and TEST_DATABASE_PASSWORD).
+"""
+
+import os
+import csv
+import json
+import time
+import uuid
+import subprocess
+
+import pytest
+
+import database_utils
+from database_utils import (
+    DatabaseManager,
+    cache_secret,
+    clear_secret_cache,
+    get_cached_secret,
+)
+
+PROJECT_ID = "test-project"
+SECRET_ID = "test-secret"
+SAMPLE_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "sample_data", "reference_data"
+)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Point the secret file cache at a private temporary directory"""
+    path = tmp_path / "secrets"
+    monkeypatch.setenv("SECRET_CACHE_DIR", str(path))
+    monkeypatch.delenv("DATABASE_PASSWORD", raising=False)
+    clear_secret_cache()
+    yield path
+    clear_secret_cache()
+
+
+def _cache_file(cache_dir):
+    files = [name for name in os.listdir(cache_dir) if name.endswith(".json")]
+    assert len(files) == 1
+    return os.path.join(cache_dir, files[0])
+
+
+def _make_manager(**kwargs):
+    return DatabaseManager(
+        project_id=PROJECT_ID,
+        secret_id=SECRET_ID,
+        host="localhost",
+        database="etl",
+        username="etl_user",
+        **kwargs
+    )
+
+
+# ===================================================================
+# SECRET CACHE
+# ===================================================================
+
+def test_secret_cache_round_trip_through_private_file(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    clear_secret_cache()
+
+    value, expires_at = get_cached_secret(PROJECT_ID, SECRET_ID)
+
+    assert value == "s3cret"
+    assert time.time() < expires_at <= time.time() + 60
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+    assert os.stat(_cache_file(cache_dir)).st_mode & 0o777 == 0o600
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
+
+
+def test_expired_secret_is_ignored(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    clear_secret_cache()
+    path = _cache_file(cache_dir)
+    with open(path, "w") as f:
+        json.dump({"value": "s3cret", "expires_at": time.time() - 1}, f)
+
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+
+
+def test_ttl_zero_skips_file_cache(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=0)
+
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+    assert not os.path.exists(cache_dir) or not os.listdir(cache_dir)
+
+
+def test_world_readable_secret_file_is_rejected(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    clear_secret_cache()
+    path = _cache_file(cache_dir)
+    with open(path, "w") as f:
+        json.dump({"value": "planted", "expires_at": time.time() + 3600}, f)
+    os.chmod(path, 0o644)
+
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+
+
+def test_symlinked_secret_file_is_rejected(cache_dir, tmp_path):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    clear_secret_cache()
+    path = _cache_file(cache_dir)
+    target = tmp_path / "planted.json"
+    target.write_text(json.dumps({"value": "planted", "expires_at": time.time() + 3600}))
+    os.chmod(target, 0o600)
+    os.unlink(path)
+    os.symlink(target, path)
+
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+
+
+def test_insecure_cache_directory_is_not_used(cache_dir):
+    os.makedirs(cache_dir)
+    os.chmod(cache_dir, 0o755)
+
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    clear_secret_cache()
+
+    assert os.listdir(cache_dir) == []
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+
+
+def test_password_from_file_keeps_file_expiry(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=10)
+    clear_secret_cache()
+    _, file_expires_at = get_cached_secret(PROJECT_ID, SECRET_ID)
+    clear_secret_cache()
+
+    db_mgr = _make_manager(secret_ttl=300)
+
+    assert db_mgr.get_password() == "s3cret"
+    assert db_mgr._password_expires_at == pytest.approx(file_expires_at)
+
+
+def test_invalidate_password_clears_all_cache_levels(cache_dir):
+    cache_secret(PROJECT_ID, SECRET_ID, "s3cret", ttl=60)
+    db_mgr = _make_manager()
+    assert db_mgr.get_password() == "s3cret"
+
+    db_mgr.invalidate_password()
+
+    assert db_mgr._password is None
+    assert get_cached_secret(PROJECT_ID, SECRET_ID) is None
+    assert os.listdir(cache_dir) == []
+
+
+def test_auth_failure_refreshes_password_and_retries(cache_dir, monkeypatch):
+    psycopg2 = pytest.importorskip("psycopg2")
+    cache_secret(PROJECT_ID, SECRET_ID, "stale", ttl=60)
+    passwords = []
+
+    def fake_pool(minconn, maxconn, **kwargs):
+        passwords.append(kwargs["password"])
+        if kwargs["password"] == "stale":
+            raise psycopg2.OperationalError('password authentication failed for user "etl_user"')
+        return object()
+
+    def fake_gcloud(*args, **kwargs):
+        return subprocess.CompletedProcess(args, 0, stdout="rotated\n", stderr="")
+
+    monkeypatch.setattr(database_utils.psycopg2_pool, "ThreadedConnectionPool", fake_pool)
+    monkeypatch.setattr(subprocess, "run", fake_gcloud)
+    db_mgr = _make_manager()
+
+    db_mgr._get_pool()
+
+    assert passwords == ["stale", "rotated"]
+    assert get_cached_secret(PROJECT_ID, SECRET_ID)[0] == "rotated"
+
+
+# ===================================================================
+# POSTGRESQL (local stand-in)
+# ===================================================================
+
+requires_postgres = pytest.mark.skipif(
+    not os.getenv("TEST_DATABASE_HOST"),
+    reason="set TEST_DATABASE_HOST to run against a local PostgreSQL"
+)
+
+
+@pytest.fixture
+def pg_manager(monkeypatch):
+    pytest.importorskip("psycopg2")
+    monkeypatch.setenv("DATABASE_PASSWORD", os.getenv("TEST_DATABASE_PASSWORD", "postgres"))
+    db_mgr = DatabaseManager(
+        project_id=PROJECT_ID,
+        secret_id=SECRET_ID,
+        host=os.environ["TEST_DATABASE_HOST"],
+        database=os.getenv("TEST_DATABASE_NAME", "postgres"),
+        username=os.getenv("TEST_DATABASE_USER", "postgres"),
+        port=int(os.getenv("TEST_DATABASE_PORT", 5432))
+    )
+    yield db_mgr
+    db_mgr.close()
+
+
+@pytest.fixture
+def table_name(pg_manager):
+    name = f"etl_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    pg_manager.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+
+def _index_names(db_mgr, table):
+    return sorted(row[0] for row in db_mgr.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = %s", (table,)
+    ))
+
+
+@requires_postgres
+def test_health_check_connects_and_reuses_pool(pg_manager):
+    assert pg_manager.health_check()
+    first_pool = pg_manager._pool
+
+    assert pg_manager.health_check()
+    assert pg_manager._pool is first_pool
+
+    pg_manager.close()
+    assert pg_manager._pool is None
+
+
+@requires_postgres
+def test_ensure_table_indexes_is_idempotent(pg_manager, table_name):
+    pg_manager.execute(f'CREATE TABLE "{table_name}" (id text, category text)')
+    pg_manager.execute(
+        f'INSERT INTO "{table_name}" VALUES (%s, %s), (%s, %s)', ("a", "x", "b", "y")
+    )
+
+    for _ in range(2):
+        assert pg_manager.ensure_table_indexes(
+            table_name, primary_key=["id"], indexes=[["category"]]
+        )
+
+    primary_keys = pg_manager.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'",
+        (table_name,)
+    )
+    assert primary_keys == [(f"{table_name}_pkey",)]
+    assert _index_names(pg_manager, table_name) == [
+        f"{table_name}_category_idx", f"{table_name}_pkey"
+    ]
+    reltuples = pg_manager.execute(
+        "SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", (table_name,)
+    )
+    assert reltuples == [(2.0,)]
+
+
+@requires_postgres
+def test_duplicate_keys_skip_primary_key_but_keep_indexes(pg_manager, table_name):
+    pg_manager.execute(f'CREATE TABLE "{table_name}" (id text, category text)')
+    pg_manager.execute(
+        f'INSERT INTO "{table_name}" VALUES (%s, %s), (%s, %s)', ("a", "x", "a", "y")
+    )
+
+    assert not pg_manager.ensure_table_indexes(
+        table_name, primary_key=["id"], indexes=[["category"]]
+    )
+    assert _index_names(pg_manager, table_name) == [f"{table_name}_category_idx"]
+
+
+@requires_postgres
+def test_optimize_reference_tables_on_sample_data(pg_manager):
+    for table in database_utils.REFERENCE_TABLE_SCHEMA:
+        with open(os.path.join(SAMPLE_DATA_DIR, f"{table}.csv")) as f:
+            rows = list(csv.reader(f))
+        header, data = rows[0], rows[1:]
+        column_defs = ", ".join(f'"{column}" text' for column in header)
+        pg_manager.execute(f'DROP TABLE IF EXISTS "{table}"')
+        pg_manager.execute(f'CREATE TABLE "{table}" ({column_defs})')
+        with pg_manager.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO "{table}" VALUES ({", ".join(["%s"] * len(header))})', data
+                )
+
+    try:
+        assert pg_manager.optimize_reference_tables() == {"products": True, "stores": True}
+        assert "products_category_idx" in _index_names(pg_manager, "products")
+        assert "stores_store_location_idx" in _index_names(pg_manager, "stores")
+    finally:
+        for table in database_utils.REFERENCE_TABLE_SCHEMA:
+            pg_manager.execute(f'DROP TABLE IF EXISTS "{table}"')
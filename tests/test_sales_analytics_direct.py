@@ -0,0 +1,154 @@
+"""
+Tests for the sales analytics job module
+
+The startup benchmark runs ``run_job`` twice against a local SparkSession,
+with GCS, Cloud SQL and BigQuery replaced by the sample CSV files and a no-op
+writer. It is skipped when PySpark or Java is not available.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import subprocess
+
+import pytest
+
+import sales_analytics_direct as job
+
+REPO_ROOT = os.path.dirname(os.path.dirname(__file__))
+SAMPLE_DATA_DIR = os.path.join(REPO_ROOT, "sample_data")
+JOB_ARGS = [
+    "--project-id", "test-project",
+    "--region", "asia-south1",
+    "--data-bucket", "test-bucket",
+    "--cloudsql-ip", "10.0.0.5",
+    "--database-name", "etl",
+    "--database-user", "etl_user",
+    "--bigquery-dataset", "sales",
+    "--sql-password-secret", "test-secret",
+]
+
+
+def test_import_has_no_side_effects():
+    env = {key: value for key, value in os.environ.items() if key != "PYSPARK_PROJECT_ID"}
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import os, sys, sales_analytics_direct; "
+         "print('pyspark' in sys.modules, 'PYSPARK_PROJECT_ID' in os.environ)"],
+        cwd=os.path.join(REPO_ROOT, "pyspark-jobs"),
+        env=env, capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_config_from_args_and_env(monkeypatch):
+    config = job.JobConfig.from_args(JOB_ARGS + ["--database-port", "6543"])
+    assert config.database_port == 6543
+    assert config.environment == "dev"
+
+    monkeypatch.setenv("PYSPARK_PROJECT_ID", "test-project")
+    monkeypatch.setenv("REGION", "asia-south1")
+    monkeypatch.setenv("DATA_BUCKET", "test-bucket")
+    monkeypatch.setenv("CLOUDSQL_IP", "10.0.0.5")
+    monkeypatch.setenv("DATABASE_NAME", "etl")
+    monkeypatch.setenv("DATABASE_USER", "etl_user")
+    monkeypatch.setenv("BIGQUERY_DATASET", "sales")
+    monkeypatch.setenv("SQL_PASSWORD_SECRET", "test-secret")
+    monkeypatch.setenv("DATABASE_PORT", "6543")
+    assert job.JobConfig.from_env() == config
+
+    monkeypatch.delenv("DATA_BUCKET")
+    with pytest.raises(ValueError, match="DATA_BUCKET"):
+        job.JobConfig.from_env()
+
+
+def test_spark_jars_lists_both_jars_once():
+    jars = job.get_spark_jars("test-bucket").split(",")
+
+    assert jars == [
+        f"gs://test-bucket/jars/{job.BIGQUERY_CONNECTOR_JAR}",
+        f"gs://test-bucket/jars/{job.POSTGRES_DRIVER_JAR}",
+    ]
+
+
+def test_database_manager_cached_per_port():
+    config = job.JobConfig.from_args(JOB_ARGS)
+    other_port = job.JobConfig.from_args(JOB_ARGS + ["--database-port", "6543"])
+    try:
+        first = job.get_database_manager(config)
+
+        assert job.get_database_manager(config) is first
+        assert job.get_database_manager(other_port) is not first
+        assert job.get_database_manager(other_port).port == 6543
+    finally:
+        job.close_database_managers()
+
+
+# ===================================================================
+# STARTUP BENCHMARK (local SparkSession)
+# ===================================================================
+
+requires_spark = pytest.mark.skipif(
+    not (shutil.which("java") or os.getenv("JAVA_HOME")),
+    reason="Java is required for a local SparkSession"
+)
+
+
+@pytest.fixture(scope="module")
+def spark():
+    """Local session, annotated with its cold creation time in seconds"""
+    pyspark_sql = pytest.importorskip("pyspark.sql")
+    started = time.perf_counter()
+    session = pyspark_sql.SparkSession.builder \
+        .master("local[1]") \
+        .appName("sales-analytics-startup-benchmark") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    session.cold_start_seconds = time.perf_counter() - started
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def local_sources(spark, monkeypatch):
+    """Serve the job's inputs from sample_data and discard its outputs"""
+    def read_sales_data(spark, config):
+        return spark.read.option("header", "true").option("inferSchema", "true") \
+            .csv(os.path.join(SAMPLE_DATA_DIR, "sales_data", "sales_data.csv"))
+
+    def read_reference_data(spark, config):
+        reference_dir = os.path.join(SAMPLE_DATA_DIR, "reference_data")
+        return (
+            spark.read.option("header", "true").csv(os.path.join(reference_dir, "products.csv")),
+            spark.read.option("header", "true").csv(os.path.join(reference_dir, "stores.csv")),
+        )
+
+    written = []
+    monkeypatch.setattr(job, "read_sales_data", read_sales_data)
+    monkeypatch.setattr(job, "read_reference_data", read_reference_data)
+    monkeypatch.setattr(job, "write_to_bigquery", lambda df, table, config: written.append(table))
+    monkeypatch.setattr(job, "_import_seconds_reported", False)
+    return written
+
+
+@requires_spark
+def test_second_run_on_reused_session_starts_fast(spark, local_sources, caplog):
+    config = job.JobConfig.from_args(JOB_ARGS)
+
+    first = job.run_job(config, spark=spark, show_results=False)
+    with caplog.at_level(logging.WARNING, logger=job.logger.name):
+        # No session passed: the active one is reused and left running
+        second = job.run_job(config, show_results=False)
+
+    print(f"\nstartup: cold session={spark.cold_start_seconds:.3f}s "
+          f"import={first['import_seconds']:.3f}s first={first['startup_seconds']:.3f}s "
+          f"second={second['startup_seconds']:.3f}s")
+    assert "import_seconds" in first
+    assert "import_seconds" not in second
+    assert second["startup_seconds"] < spark.cold_start_seconds / 10
+    assert "were not applied" in caplog.text
+    assert local_sources == ["daily_sales_summary", "product_performance", "store_performance"] * 2
+    assert spark.range(1).count() == 1
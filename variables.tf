@@ -203,6 +203,13 @@ variable "dataproc_preemptible_nodes" {
   default     = 0
 }
 
+# Python packages required by the PySpark jobs (see pyspark-jobs/requirements.txt)
+variable "dataproc_pip_packages" {
+  description = "Space-separated pip packages installed on Dataproc nodes"
+  type        = string
+  default     = "psycopg2-binary==2.9.9"
+}
+
 # ===================================================================
 # ANALYTICS CONFIGURATION (BIGQUERY)
 # ===================================================================